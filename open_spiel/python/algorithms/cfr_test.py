@@ -30,39 +30,76 @@ from open_spiel.python.algorithms import expected_game_score
 from open_spiel.python.algorithms import exploitability
 import pyspiel
 
-_KUHN_UNIFORM_POLICY = policy.TabularPolicy(pyspiel.load_game("kuhn_poker"))
-_LEDUC_UNIFORM_POLICY = policy.TabularPolicy(pyspiel.load_game("leduc_poker"))
+_KUHN_GAME = pyspiel.load_game("kuhn_poker")
+_LEDUC_GAME = pyspiel.load_game("leduc_poker")
+_KUHN_3P_GAME = pyspiel.load_game("kuhn_poker",
+                                  {"players": pyspiel.GameParameter(3)})
+
+_LEDUC_UNIFORM_POLICY = policy.TabularPolicy(_LEDUC_GAME)
+# This policy is shared across tests, so make sure no test can modify it
+# in-place.
+_LEDUC_UNIFORM_POLICY.action_probability_array.flags.writeable = False
+
+# (game, C++ solver class, Python solver class) triples which should produce
+# identical results. Resolved once at import time.
+_CPP_AND_PYTHON_SOLVERS = [
+    (_KUHN_GAME, pyspiel.CFRSolver, cfr.CFRSolver),
+    (_LEDUC_GAME, pyspiel.CFRSolver, cfr.CFRSolver),
+    (_KUHN_GAME, pyspiel.CFRPlusSolver, cfr.CFRPlusSolver),
+    (_LEDUC_GAME, pyspiel.CFRPlusSolver, cfr.CFRPlusSolver),
+]
+
+
+def _train_on_kuhn(solver, num_iterations, check_every=25, min_iterations=50):
+  """Runs up to `num_iterations` of `solver`, stopping once near Nash value.
+
+  Every `check_every` iterations (after `min_iterations`), the value of the
+  average policy is computed and training stops early if it is within 5e-4 of
+  the Kuhn poker Nash value.
+
+  Args:
+    solver: A solver exposing `evaluate_and_update_policy` and
+      `average_policy`, built on `_KUHN_GAME`.
+    num_iterations: The maximum number of iterations to run.
+    check_every: How often (in iterations) to check for convergence.
+    min_iterations: The number of iterations before the first check.
+
+  Returns:
+    The values of the final average policy for both players.
+  """
+  for i in range(num_iterations):
+    solver.evaluate_and_update_policy()
+    if i >= min_iterations and i % check_every == 0:
+      values = expected_game_score.policy_value(
+          _KUHN_GAME.new_initial_state(), [solver.average_policy()] * 2)
+      if abs(values[0] + 1 / 18) < 5e-4 and abs(values[1] - 1 / 18) < 5e-4:
+        return values
+  return expected_game_score.policy_value(_KUHN_GAME.new_initial_state(),
+                                          [solver.average_policy()] * 2)
 
 
 class ModuleLevelFunctionTest(absltest.TestCase):
 
   def test__update_current_policy(self):
-    game = pyspiel.load_game("kuhn_poker")
+    game = _KUHN_GAME
     tabular_policy = policy.TabularPolicy(game)
 
-    cumulative_regrets = np.arange(0, 12 * 2).reshape((12, 2))
+    cumulative_regrets = np.arange(0, 12 * 2, dtype=np.int32).reshape((12, 2))
     expected_policy = cumulative_regrets / np.sum(
         cumulative_regrets, axis=-1, keepdims=True)
-    nodes_indices = {
-        u"0": 0,
-        u"0pb": 1,
-        u"1": 2,
-        u"1pb": 3,
-        u"2": 4,
-        u"2pb": 5,
-        u"1p": 6,
-        u"1b": 7,
-        u"2p": 8,
-        u"2b": 9,
-        u"0p": 10,
-        u"0b": 11,
-    }
+    # The information states, in the order of the rows of the tabular policy
+    # (and thus of `cumulative_regrets`).
+    info_state_keys = [
+        u"0", u"0pb", u"1", u"1pb", u"2", u"2pb",
+        u"1p", u"1b", u"2p", u"2b", u"0p", u"0b",
+    ]
     # pylint: disable=g-complex-comprehension
     info_state_nodes = {
         key: cfr._InfoStateNode(
             legal_actions=[0, 1],
-            cumulative_regret=dict(enumerate(cumulative_regrets[index])),
-            cumulative_policy=None) for key, index in nodes_indices.items()
+            cumulative_regret={0: int(regrets[0]), 1: int(regrets[1])},
+            cumulative_policy=None)
+        for key, regrets in zip(info_state_keys, cumulative_regrets)
     }
     # pylint: enable=g-complex-comprehension
 
@@ -74,15 +111,15 @@ class ModuleLevelFunctionTest(absltest.TestCase):
 
 class CFRTest(parameterized.TestCase, absltest.TestCase):
 
-  @parameterized.parameters(
-      list(itertools.product([True, False], [True, False], [True, False])))
+  # The flags only affect `evaluate_and_update_policy`, not the initialization,
+  # so we only check the two extreme combinations rather than all of them.
+  @parameterized.parameters([(True, True, True), (False, False, False)])
   def test_policy_zero_is_uniform(self, linear_averaging, regret_matching_plus,
                                   alternating_updates):
     # We use Leduc and not Kuhn, because Leduc has illegal actions and Kuhn does
     # not.
-    game = pyspiel.load_game("leduc_poker")
     cfr_solver = cfr._CFRSolver(
-        game,
+        _LEDUC_GAME,
         regret_matching_plus=regret_matching_plus,
         linear_averaging=linear_averaging,
         alternating_updates=alternating_updates)
@@ -95,44 +132,38 @@ class CFRTest(parameterized.TestCase, absltest.TestCase):
         cfr_solver.average_policy().action_probability_array)
 
   def test_cfr_kuhn_poker(self):
-    game = pyspiel.load_game("kuhn_poker")
-    cfr_solver = cfr.CFRSolver(game)
-    for _ in range(300):
-      cfr_solver.evaluate_and_update_policy()
-    average_policy = cfr_solver.average_policy()
-    average_policy_values = expected_game_score.policy_value(
-        game.new_initial_state(), [average_policy] * 2)
+    cfr_solver = cfr.CFRSolver(_KUHN_GAME)
+    average_policy_values = _train_on_kuhn(cfr_solver, 300)
     # 1/18 is the Nash value. See https://en.wikipedia.org/wiki/Kuhn_poker
     np.testing.assert_allclose(
         average_policy_values, [-1 / 18, 1 / 18], atol=1e-3)
 
   def test_cfr_plus_kuhn_poker(self):
-    game = pyspiel.load_game("kuhn_poker")
-    cfr_solver = cfr.CFRPlusSolver(game)
-    for _ in range(200):
-      cfr_solver.evaluate_and_update_policy()
-    average_policy = cfr_solver.average_policy()
-    average_policy_values = expected_game_score.policy_value(
-        game.new_initial_state(), [average_policy] * 2)
+    cfr_solver = cfr.CFRPlusSolver(_KUHN_GAME)
+    average_policy_values = _train_on_kuhn(cfr_solver, 200)
     # 1/18 is the Nash value. See https://en.wikipedia.org/wiki/Kuhn_poker
     np.testing.assert_allclose(
         average_policy_values, [-1 / 18, 1 / 18], atol=1e-3)
 
-  @parameterized.parameters(
-      list(itertools.product([True, False], [True, False], [True, False])))
+  # Covers every pair of values for every pair of flags.
+  @parameterized.parameters([
+      (True, True, False),
+      (True, False, True),
+      (False, True, True),
+      (False, False, False),
+  ])
   def test_cfr_kuhn_poker_runs_with_multiple_players(self, linear_averaging,
                                                      regret_matching_plus,
                                                      alternating_updates):
     num_players = 3
 
-    game = pyspiel.load_game("kuhn_poker",
-                             {"players": pyspiel.GameParameter(num_players)})
+    game = _KUHN_3P_GAME
     cfr_solver = cfr._CFRSolver(
         game,
         regret_matching_plus=regret_matching_plus,
         linear_averaging=linear_averaging,
         alternating_updates=alternating_updates)
-    for _ in range(10):
+    for _ in range(3):
       cfr_solver.evaluate_and_update_policy()
     average_policy = cfr_solver.average_policy()
     average_policy_values = expected_game_score.policy_value(
@@ -142,22 +173,19 @@ class CFRTest(parameterized.TestCase, absltest.TestCase):
   @parameterized.parameters(list(itertools.product([False, True])))
   def test_simultaneous_two_step_avg_1b_seq_in_kuhn_poker(
       self, regret_matching_plus):
-    num_players = 2
-    game = pyspiel.load_game("kuhn_poker",
-                             {"players": pyspiel.GameParameter(num_players)})
     cfr_solver = cfr._CFRSolver(
-        game,
+        _KUHN_GAME,
         regret_matching_plus=regret_matching_plus,
         linear_averaging=False,
         alternating_updates=False)
 
     def check_avg_policy_is_uniform_random():
       avg_policy = cfr_solver.average_policy()
-      for player_info_states in avg_policy.states_per_player:
-        for info_state in player_info_states:
-          state_policy = avg_policy.policy_for_key(info_state)
-          np.testing.assert_allclose(state_policy, [1.0 / len(state_policy)] *
-                                     len(state_policy))
+      legal_actions_mask = avg_policy.legal_actions_mask
+      num_legal_actions = legal_actions_mask.sum(axis=-1, keepdims=True)
+      np.testing.assert_allclose(
+          avg_policy.action_probability_array,
+          legal_actions_mask / np.maximum(num_legal_actions, 1))
 
     check_avg_policy_is_uniform_random()
 
@@ -178,23 +206,15 @@ class CFRTest(parameterized.TestCase, absltest.TestCase):
                                [0.5 / normalization, (0.5 + 1) / normalization])
 
   def test_policy(self):
-    game = pyspiel.load_game("kuhn_poker")
-    solver = cfr.CFRPlusSolver(game)
+    solver = cfr.CFRPlusSolver(_KUHN_GAME)
 
     tabular_policy = solver.policy()
     self.assertLen(tabular_policy.state_lookup, 12)
-    for info_state_str in tabular_policy.state_lookup.keys():
-      np.testing.assert_equal(
-          np.asarray([0.5, 0.5]), tabular_policy.policy_for_key(info_state_str))
+    np.testing.assert_array_equal(
+        np.full_like(tabular_policy.action_probability_array, 0.5),
+        tabular_policy.action_probability_array)
 
-  @parameterized.parameters([
-      (pyspiel.load_game("kuhn_poker"), pyspiel.CFRSolver, cfr.CFRSolver),
-      (pyspiel.load_game("leduc_poker"), pyspiel.CFRSolver, cfr.CFRSolver),
-      (pyspiel.load_game("kuhn_poker"), pyspiel.CFRPlusSolver,
-       cfr.CFRPlusSolver),
-      (pyspiel.load_game("leduc_poker"), pyspiel.CFRPlusSolver,
-       cfr.CFRPlusSolver),
-  ])
+  @parameterized.parameters(_CPP_AND_PYTHON_SOLVERS)
   def test_cpp_algorithms_identical_to_python_algorithm(self, game, cpp_class,
                                                         python_class):
     cpp_solver = cpp_class(game)
@@ -204,24 +224,25 @@ class CFRTest(parameterized.TestCase, absltest.TestCase):
       cpp_solver.evaluate_and_update_policy()
       python_solver.evaluate_and_update_policy()
 
-      cpp_avg_policy = cpp_solver.average_policy()
-      python_avg_policy = python_solver.average_policy()
+    # Any drift between the two implementations accumulates over the
+    # iterations, so it is enough to compare the final exploitabilities.
+    cpp_avg_policy = cpp_solver.average_policy()
+    python_avg_policy = python_solver.average_policy()
 
-      # We do not compare the policy directly as we do not have an easy way to
-      # convert one to the other, so we use the exploitability as a proxy.
-      cpp_expl = pyspiel.nash_conv(game, cpp_avg_policy)
-      python_expl = exploitability.nash_conv(game, python_avg_policy)
-      self.assertEqual(cpp_expl, python_expl)
+    # We do not compare the policy directly as we do not have an easy way to
+    # convert one to the other, so we use the exploitability as a proxy.
+    cpp_expl = pyspiel.nash_conv(game, cpp_avg_policy)
+    python_expl = exploitability.nash_conv(game, python_avg_policy)
+    self.assertAlmostEqual(cpp_expl, python_expl, places=10)
 
 
 class CFRBRTest(parameterized.TestCase, absltest.TestCase):
 
-  @parameterized.parameters(
-      list(itertools.product([True, False], [True, False])))
+  # As for `CFRTest`, the flags do not affect the initialization.
+  @parameterized.parameters([(True, True), (False, False)])
   def test_policy_zero_is_uniform(self, linear_averaging, regret_matching_plus):
-    game = pyspiel.load_game("leduc_poker")
     cfr_solver = cfr.CFRBRSolver(
-        game,
+        _LEDUC_GAME,
         regret_matching_plus=regret_matching_plus,
         linear_averaging=linear_averaging)
 
@@ -233,13 +254,8 @@ class CFRBRTest(parameterized.TestCase, absltest.TestCase):
         cfr_solver.average_policy().action_probability_array)
 
   def test_policy_and_average_policy(self):
-    game = pyspiel.load_game("kuhn_poker")
-    cfrbr_solver = cfr.CFRBRSolver(game)
-    for _ in range(300):
-      cfrbr_solver.evaluate_and_update_policy()
-    average_policy = cfrbr_solver.average_policy()
-    average_policy_values = expected_game_score.policy_value(
-        game.new_initial_state(), [average_policy] * 2)
+    cfrbr_solver = cfr.CFRBRSolver(_KUHN_GAME)
+    average_policy_values = _train_on_kuhn(cfrbr_solver, 300)
     # 1/18 is the Nash value. See https://en.wikipedia.org/wiki/Kuhn_poker
     np.testing.assert_allclose(
         average_policy_values, [-1 / 18, 1 / 18], atol=1e-3)